@@ -3,5 +3,31 @@ Module which contains a series of tools and utilities which help training and do
 network defined in PyTorch.
 """
 
-from .checkpoint_handler import CheckpointHandler
-from .tensorboard_writer import TensorboardWriter
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+if TYPE_CHECKING:
+    from .checkpoint_handler import CheckpointHandler
+    from .tensorboard_writer import TensorboardWriter
+
+__all__ = ["CheckpointHandler", "TensorboardWriter"]
+
+# The submodules are imported when their class is first accessed, so that using one of them doesn't pay for the
+# dependencies of the other
+_LAZY_ATTRIBUTES = {
+    "CheckpointHandler": ".checkpoint_handler",
+    "TensorboardWriter": ".tensorboard_writer",
+}
+
+def __getattr__(name: str) -> Any:
+    """Import the submodule defining the requested class, and return the class."""
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__() -> List[str]:
+    """List the attributes of the module, including the classes which haven't been imported yet."""
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
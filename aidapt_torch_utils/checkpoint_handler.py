@@ -1,11 +1,28 @@
 """Contains the utils needed to save/load checkpoints for PyTorch models."""
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
+import contextlib
+import copy
+import hashlib
+import mmap
+import multiprocessing
+import queue
+import weakref
+import zipfile
+from safetensors import safe_open
+from safetensors.torch import save as save_safetensors
 import torch
 import os
 
-@dataclass
+_STAGING_ALIGNMENT = 64
+_CUDA_HOST_REGISTER_PORTABLE = 1
+_DIRECT_IO_ALIGNMENT = 4096
+_DIRECT_IO_BUFFER_SIZE = 4 * 1024 * 1024
+# Moment estimates kept by Adam and its variants, which tolerate a lower precision
+_OPTIMIZER_MOMENT_KEYS = ('exp_avg', 'exp_avg_sq', 'max_exp_avg_sq')
+
+@dataclass(slots=True)
 class CheckpointData:
     """Class which contains data from a loaded checkpoint.
     
@@ -22,35 +39,619 @@ class CheckpointData:
     optimizer: Optional[torch.optim.Optimizer]
     epoch: int
 
+@dataclass(slots=True)
+class _StagedTensor:
+    """Class which takes the place of a tensor inside of a state staged for the checkpoint writer process.
+
+    Attributes:
+        offset (int): Offset in bytes of the tensor's data inside of the staging buffer
+        dtype (torch.dtype): The dtype of the tensor
+        shape (torch.Size): The shape of the tensor
+    """
+
+    offset: int
+    dtype: torch.dtype
+    shape: torch.Size
+
+    def raw(self, buffer: torch.Tensor) -> torch.Tensor:
+        """Return the bytes of the tensor described by the instance, as a view of the given staging buffer."""
+        return buffer[self.offset:self.offset + self.shape.numel() * self.dtype.itemsize]
+
+    def view(self, buffer: torch.Tensor) -> torch.Tensor:
+        """Return the tensor described by the instance as a view of the given staging buffer."""
+        return self.raw(buffer).view(self.dtype).view(self.shape)
+
+def _plan_staging(state: Any) -> Tuple[Any, List[Tuple[_StagedTensor, torch.Tensor]], int]:
+    """Assign to every tensor contained in a (nested) state its place inside of a single staging buffer.
+
+    Having a single buffer means that the whole state can be handed to the checkpoint writer process by
+    sharing one file descriptor, instead of one for each tensor.
+
+    Attributes:
+        state (Any): The state to be staged, made of nested dicts, lists and tuples
+
+    Returns:
+        A copy of the state where every tensor is replaced by a _StagedTensor, the list of the (_StagedTensor, tensor)
+        pairs whose data has to be copied into the buffer, and the size in bytes of the buffer
+    """
+    staged_tensors = []
+    size = 0
+
+    def replace(obj: Any) -> Any:
+        nonlocal size
+        if isinstance(obj, torch.Tensor) and obj.layout == torch.strided and not obj.is_quantized:
+            staged_tensor = _StagedTensor(size, obj.dtype, obj.shape)
+            staged_tensors.append((staged_tensor, obj))
+            size += -(-obj.numel() * obj.element_size() // _STAGING_ALIGNMENT) * _STAGING_ALIGNMENT
+            return staged_tensor
+        if isinstance(obj, dict):
+            # copy.copy keeps the attributes of the dict, such as the _metadata of a state_dict
+            staged = copy.copy(obj)
+            for key, value in obj.items():
+                staged[key] = replace(value)
+            return staged
+        if isinstance(obj, list):
+            return [replace(value) for value in obj]
+        if isinstance(obj, tuple):
+            return tuple(replace(value) for value in obj)
+        return obj
+
+    return replace(state), staged_tensors, size
+
+def _split_aliases(state_dict: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Remove from a state_dict the tensors which are the same view of the same data as a previous one.
+
+    This is the case of tied weights, such as an embedding shared with the output projection, which would
+    otherwise be staged and written once for each of their names.
+
+    Attributes:
+        state_dict (Dict[str, Any]): The state_dict to be deduplicated
+
+    Returns:
+        A copy of the state_dict without the aliases, and a dict mapping the name of each alias to the name of the
+        tensor it refers to
+    """
+    deduplicated = copy.copy(state_dict)
+    aliases = {}
+    seen = {}
+    for name, value in state_dict.items():
+        if not isinstance(value, torch.Tensor) or value.numel() == 0 or value.layout != torch.strided:
+            continue
+
+        key = (value.device, value.data_ptr(), value.dtype, value.shape, value.stride())
+        if key in seen:
+            aliases[name] = seen[key]
+            del deduplicated[name]
+        else:
+            seen[key] = name
+    return deduplicated, aliases
+
+def _cast_optimizer_moments(optimizer_state_dict: Dict[str, Any], dtype: torch.dtype) -> Dict[str, Any]:
+    """Return a copy of the state_dict of an optimizer, where the moment estimates of Adam are cast to dtype.
+
+    The state of other optimizers, which doesn't contain the moment estimates, is left as it is.
+
+    Attributes:
+        optimizer_state_dict (Dict[str, Any]): The state_dict of the optimizer, which is not modified
+        dtype (torch.dtype): The dtype the moment estimates are cast to
+
+    Returns:
+        The state_dict with the moment estimates cast to dtype
+    """
+    # The state of each parameter is the same dict used by the optimizer, so it has to be copied
+    state = {
+        index: {
+            key: value.to(dtype) if key in _OPTIMIZER_MOMENT_KEYS and torch.is_floating_point(value) else value
+            for key, value in parameter_state.items()
+        }
+        for index, parameter_state in optimizer_state_dict['state'].items()
+    }
+    return {**optimizer_state_dict, 'state': state}
+
+def _allocate_staging_buffer(size: int, pin: bool) -> torch.Tensor:
+    """Allocate a staging buffer in shared memory.
+
+    Attributes:
+        size (int): The size in bytes of the buffer
+        pin (bool): If True, the buffer is also page-locked, so that the copies from CUDA tensors are asynchronous
+
+    Returns:
+        The buffer, as a tensor of bytes
+    """
+    buffer = torch.empty(size, dtype=torch.uint8).share_memory_()
+    if pin and size > 0:
+        cudart = torch.cuda.cudart()
+        torch.cuda.check_error(cudart.cudaHostRegister(buffer.data_ptr(), size, _CUDA_HOST_REGISTER_PORTABLE))
+        # Not run at exit, when the CUDA context may have already been destroyed
+        weakref.finalize(buffer, cudart.cudaHostUnregister, buffer.data_ptr()).atexit = False
+    return buffer
+
+def _restore_state(skeleton: Any, buffer: torch.Tensor) -> Any:
+    """Return the state staged by _plan_staging, where every _StagedTensor is replaced by a copy of its data.
+
+    The tensors are copied out of the buffer since torch.save would otherwise write the whole buffer, and
+    refuses tensors of different dtypes sharing the same storage.
+    """
+    if isinstance(skeleton, _StagedTensor):
+        return skeleton.view(buffer).clone()
+    if isinstance(skeleton, dict):
+        state = copy.copy(skeleton)
+        for key, value in skeleton.items():
+            state[key] = _restore_state(value, buffer)
+        return state
+    if isinstance(skeleton, list):
+        return [_restore_state(value, buffer) for value in skeleton]
+    if isinstance(skeleton, tuple):
+        return tuple(_restore_state(value, buffer) for value in skeleton)
+    return skeleton
+
+class _UncachedFile:
+    """Class which writes a file opened with O_DIRECT, so that its data doesn't go through the page cache.
+
+    O_DIRECT requires aligned writes, so the data is accumulated into a page-aligned buffer, which is written
+    whenever it is full. The last block is padded, and the file is truncated to its actual size once closed.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize an instance of the class _UncachedFile.
+
+        Attributes:
+            path (str): Path of the file to be written
+        """
+        # The same mode open uses, as torch.save does when given a path
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o666)
+        # Anonymous maps are page-aligned
+        self._buffer = mmap.mmap(-1, _DIRECT_IO_BUFFER_SIZE)
+        self._buffered = 0
+        self._size = 0
+
+    def write(self, data: Any) -> int:
+        """Write a bytes-like object, returning the number of bytes written."""
+        with memoryview(data) as view, view.cast("B") as data_bytes:
+            written = 0
+            while written < len(data_bytes):
+                chunk = min(len(data_bytes) - written, len(self._buffer) - self._buffered)
+                self._buffer[self._buffered:self._buffered + chunk] = data_bytes[written:written + chunk]
+                self._buffered += chunk
+                written += chunk
+                if self._buffered == len(self._buffer):
+                    self._write_buffer(self._buffered)
+
+        self._size += written
+        return written
+
+    def flush(self) -> None:
+        """Do nothing, since the buffered data can only be written once a whole block is available."""
+
+    def close(self) -> None:
+        """Write the buffered data and close the file."""
+        try:
+            if self._buffered > 0:
+                aligned = -(-self._buffered // _DIRECT_IO_ALIGNMENT) * _DIRECT_IO_ALIGNMENT
+                self._buffer[self._buffered:aligned] = bytes(aligned - self._buffered)
+                self._write_buffer(aligned)
+            os.ftruncate(self._fd, self._size)
+        finally:
+            os.close(self._fd)
+            self._buffer.close()
+
+    def _write_buffer(self, nbytes: int) -> None:
+        """Write the first nbytes of the buffer to the file, and empty the buffer."""
+        with memoryview(self._buffer) as view:
+            offset = 0
+            while offset < nbytes:
+                offset += os.write(self._fd, view[offset:nbytes])
+        self._buffered = 0
+
+def _torch_save(obj: Any, f: Any) -> None:
+    """Save an object through torch.save, in the zipfile format which CheckpointHandler.load_checkpoint memory-maps.
+
+    The pickle protocol is left to the default one, since the weights_only unpickler used when loading doesn't support
+    the opcodes of the newer protocols. The data of the tensors is written outside of the pickle in any case.
+    """
+    torch.save(obj, f, _use_new_zipfile_serialization=True)
+
+def _commit_file(path: str, drop_page_cache: bool) -> None:
+    """Write on disk the data of the temporary file of path, then atomically rename it to path.
+
+    Attributes:
+        path (str): The path of the file, whose data has been written in path + ".tmp"
+        drop_page_cache (bool): If True, the data of the file is also dropped from the page cache
+    """
+    temporary_path = path + ".tmp"
+    fd = os.open(temporary_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        # Dirty pages can't be dropped, so this has to happen after the fsync
+        if drop_page_cache and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    os.replace(temporary_path, path)
+
+def _sync_directory(path: str) -> None:
+    """Write on disk the entries of a directory, such as the files which have been renamed in it."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class _CheckpointWriter:
+    """Class which writes on disk the checkpoints staged by a CheckpointHandler, from its background process.
+
+    Attributes:
+        full_checkpoint_interval (int): Save interval of the full checkpoints. The checkpoints in between only contain
+            the tensors of the model's state_dict whose data changed, and reference the files containing the others
+        bypass_page_cache (bool): If True, the checkpoints are kept out of the page cache
+    """
+
+    def __init__(self, full_checkpoint_interval: int, bypass_page_cache: bool) -> None:
+        """Initialize an instance of the class _CheckpointWriter.
+
+        Attributes:
+            full_checkpoint_interval (int): Save interval of the full checkpoints
+            bypass_page_cache (bool): If True, the checkpoints are kept out of the page cache
+        """
+        self.full_checkpoint_interval = full_checkpoint_interval
+        self.bypass_page_cache = bypass_page_cache
+        self._saves = 0
+        # For each tensor of the model's state_dict, its dtype, shape and hash of its data, and the file where it was last written
+        self._tensor_hashes = {}
+        self._tensor_files = {}
+
+    def run(self, jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+        """Write on disk the checkpoints received from a CheckpointHandler, until the None sentinel is received.
+
+        This method is the body of the background process spawned by the CheckpointHandler. The outcome of
+        every save is reported back as a (filename, error) tuple, where error is None if the save succeeded.
+
+        Attributes:
+            jobs (multiprocessing.Queue): Queue of (buffer, skeleton, filename, weights_filename) tuples, where buffer
+                and skeleton are produced by CheckpointHandler._stage_state, and weights_filename is None if the weights
+                are not saved as safetensors
+            results (multiprocessing.Queue): Queue where the outcome of every save is put
+        """
+        for buffer, skeleton, filename, weights_filename in iter(jobs.get, None):
+            try:
+                self.save(buffer, skeleton, filename, weights_filename)
+            except Exception as exception:
+                results.put((filename, repr(exception)))
+            else:
+                results.put((filename, None))
+
+    def save(self, buffer: torch.Tensor, skeleton: Dict[str, Any], filename: str, weights_filename: Optional[str]) -> None:
+        """Write on disk a checkpoint staged by CheckpointHandler._stage_state.
+
+        Attributes:
+            buffer (torch.Tensor): The staging buffer holding the data of the tensors
+            skeleton (Dict[str, Any]): The staged checkpoint
+            filename (str): Path of the file where the checkpoint is saved through torch.save
+            weights_filename (Optional[str]): If present, path of the safetensors file where the tensors of the
+                model's state_dict are saved
+        """
+        try:
+            if self.full_checkpoint_interval > 1:
+                self._reference_unchanged_tensors(skeleton, buffer, os.path.basename(weights_filename or filename))
+            self.write(_restore_state(skeleton, buffer), filename, weights_filename)
+        except Exception:
+            # The hashes may refer to tensors which didn't get written
+            self._tensor_hashes.clear()
+            raise
+
+    def _reference_unchanged_tensors(self, skeleton: Dict[str, Any], buffer: torch.Tensor, tensors_file: str) -> None:
+        """Replace the tensors of the model's state_dict whose data didn't change with references to their files.
+
+        The references are stored under the 'references' key of the checkpoint, as a dict mapping the name of each
+        tensor to the name of the file containing it, which is always found next to the checkpoint.
+
+        Attributes:
+            skeleton (Dict[str, Any]): The staged checkpoint, which is modified in place
+            buffer (torch.Tensor): The staging buffer holding the data of the tensors
+            tensors_file (str): Name of the file where the tensors of the model's state_dict are going to be written
+        """
+        full = self._saves % self.full_checkpoint_interval == 0
+        self._saves += 1
+
+        state_dict = skeleton['state_dict']
+        references = {}
+        for name, value in list(state_dict.items()):
+            if not isinstance(value, _StagedTensor):
+                continue
+
+            # The same bytes may hold a tensor of a different dtype or shape
+            tensor_hash = (value.dtype, value.shape, hashlib.blake2b(value.raw(buffer).numpy(), digest_size=16).digest())
+            if not full and self._tensor_hashes.get(name) == tensor_hash:
+                references[name] = self._tensor_files[name]
+                del state_dict[name]
+            else:
+                self._tensor_hashes[name] = tensor_hash
+                self._tensor_files[name] = tensors_file
+
+        if references:
+            skeleton['references'] = references
+
+    def write(self, state: Dict[str, Any], filename: str, weights_filename: Optional[str]) -> None:
+        """Write a checkpoint on disk.
+
+        Attributes:
+            state (Dict[str, Any]): The content of the checkpoint, as built by CheckpointHandler.save_checkpoint
+            filename (str): Path of the file where the checkpoint is saved through torch.save
+            weights_filename (Optional[str]): If present, path of the safetensors file where the tensors of the
+                model's state_dict are saved, instead of saving them in filename
+        """
+        # The files are written under a temporary name and renamed once complete, so that a crash during the save never
+        # leaves a truncated checkpoint behind. The checkpoint is renamed last, since it is the file being looked for
+        if weights_filename is not None:
+            state_dict = state.pop('state_dict')
+            # Serialized in memory, since save_file writes through a temporary file of its own, which is only readable
+            # by the owner and can't be opened with O_DIRECT
+            with contextlib.closing(self._open_temporary_file(weights_filename)) as file:
+                file.write(save_safetensors({key: value for key, value in state_dict.items() if isinstance(value, torch.Tensor)}))
+            _commit_file(weights_filename, self.bypass_page_cache)
+            state['weights'] = os.path.basename(weights_filename)
+            # Entries which are not tensors, such as the extra state of a module, can't be saved as safetensors.
+            # copy.copy keeps the _metadata of the state_dict, which holds the version of each module
+            state['state_dict'] = copy.copy(state_dict)
+            for key, value in state_dict.items():
+                if isinstance(value, torch.Tensor):
+                    del state['state_dict'][key]
+
+        with contextlib.closing(self._open_temporary_file(filename)) as file:
+            _torch_save(state, file)
+        _commit_file(filename, self.bypass_page_cache)
+        # A single sync of the directory makes both renames durable
+        _sync_directory(os.path.dirname(filename) or ".")
+
+    def _open_temporary_file(self, path: str) -> Any:
+        """Open for writing the temporary file of path, with O_DIRECT if the page cache is bypassed and O_DIRECT is supported.
+
+        Otherwise the file is opened through open, and its data is dropped from the page cache once written, see
+        _commit_file.
+
+        Attributes:
+            path (str): The path of the file, whose data is written in path + ".tmp"
+
+        Returns:
+            The file object, which has to be closed once written
+        """
+        if self.bypass_page_cache and hasattr(os, "O_DIRECT"):
+            try:
+                return _UncachedFile(path + ".tmp")
+            except OSError:
+                # Some filesystems, such as tmpfs, don't support O_DIRECT
+                pass
+        return open(path + ".tmp", "wb")
+
+def _stop_writer(jobs: multiprocessing.Queue, process: multiprocessing.Process) -> None:
+    """Send the termination sentinel to the checkpoint writer process and wait for it to exit."""
+    jobs.put(None)
+    process.join()
+
 class CheckpointHandler:
     """Class which handles checkpoints for a PyTorch model.
     
     This class contains the methods used to save a checkpoint, or load one. The checkpoints will contain
     the model and the optimizer with the new weights, which can be used to resume training.
 
+    By default, the checkpoints are written on disk by a background process, spawned on the first save, so that
+    saving a checkpoint only blocks the training for the time needed to copy the weights in memory. As with
+    any spawned process, a script saving checkpoints must then be guarded by `if __name__ == "__main__":`, or
+    create the CheckpointHandler with async_save=False. The method close should be called once the training is
+    over, to wait for the last checkpoints to be written.
+
     Attributes:
         device (torch.device): Used by the CheckpointHandler to load the checkpoint on the correct device
         checkpoint_dir (str): Path where the checkpoints will be saved or loaded
         interval (int): Epoch interval, which dictates how often the checkpoints may be saved
+        use_safetensors (bool): If True, the model's weights are saved in a safetensors file next to the checkpoint
+        full_checkpoint_interval (int): Every how many saves a full checkpoint is written, instead of one which only
+            contains the model's weights which changed since the previous save
+        bypass_page_cache (bool): If True, the checkpoints are kept out of the page cache once written
+        optimizer_dtype (Optional[torch.dtype]): If present, the dtype the moment estimates of Adam are saved with
+        async_save (bool): If True, the checkpoints are written on disk by a background process
     """
 
-    def __init__(self, device: torch.device, interval: int, checkpoint_dir: str = "") -> None:
+    def __init__(
+            self, device: torch.device, interval: int, checkpoint_dir: str = "", use_safetensors: bool = True,
+            full_checkpoint_interval: int = 1, bypass_page_cache: bool = True,
+            optimizer_dtype: Optional[torch.dtype] = None, async_save: bool = True) -> None:
         """Initialize an instance of the class CheckpointHandler.
         
         Attributes:
             device (torch.device): Used by the CheckpointHandler to load the checkpoint on the correct device
             checkpoint_dir (str): Path where the checkpoints will be saved or loaded
             interval (int): Epoch interval, which dictates how often the checkpoints may be saved
+            use_safetensors (bool): If True, the model's weights are saved in a safetensors file next to the checkpoint,
+                which avoids unpickling them when loading. The optimizer is always saved in the checkpoint itself
+            full_checkpoint_interval (int): Every how many saves a full checkpoint is written. The checkpoints in between
+                only contain the model's weights which changed since the previous save, and load the others from the
+                checkpoints they reference: none of them should be deleted until the next full checkpoint is written.
+                With the default of 1, every checkpoint is a full one
+            bypass_page_cache (bool): If True, the checkpoints are written with O_DIRECT where supported, or dropped from
+                the page cache once written, so that they don't evict the pages cached for the dataset
+            optimizer_dtype (Optional[torch.dtype]): If present, the dtype, such as torch.bfloat16, the moment estimates
+                of Adam are cast to in the checkpoints, halving the size of the optimizer's state. They are cast back to
+                the dtype of their parameters when loaded, so training resumes with a slightly less precise optimizer
+                state: not to be used when an exact resume is needed
+            async_save (bool): If True, the checkpoints are written on disk by a background process, spawned on the first
+                save. Otherwise save_checkpoint writes them before returning, which doesn't require the script to be
+                guarded by `if __name__ == "__main__":`
         """
         self.interval = interval
         self.checkpoint_dir = checkpoint_dir
         self.device = device
+        self.use_safetensors = use_safetensors
+        self.full_checkpoint_interval = full_checkpoint_interval
+        self.bypass_page_cache = bypass_page_cache
+        self.optimizer_dtype = optimizer_dtype
+        self.async_save = async_save
+
+        self._writer = _CheckpointWriter(full_checkpoint_interval, bypass_page_cache)
+        # Started on the first save when async_save is True, see _start_save_process
+        self._save_process = None
+        self._pending_saves = 0
+        # Latest epoch among the checkpoints in checkpoint_dir, None until the directory is scanned
+        self._latest_epoch = None
+        # Reused across saves, and only reallocated when a bigger one is needed
+        self._staging_buffer = _allocate_staging_buffer(0, pin=False)
+        self._staging_buffer_pinned = False
+        self._staging_streams = {}
+
+    def close(self) -> None:
+        """Wait for the pending checkpoints to be written, then stop the background process which writes them.
+
+        The instance can still be used afterwards: the next save spawns a new background process, and is always a full
+        checkpoint.
+        """
+        if self._save_process is None:
+            return
+
+        try:
+            self._collect_saves(wait=True)
+        finally:
+            self._stop_save_process()
+            self._save_process = None
+            self._pending_saves = 0
+            del self._save_jobs, self._save_results, self._stop_save_process
+
+    def _start_save_process(self) -> None:
+        """Spawn the background process which writes the checkpoints on disk."""
+        context = multiprocessing.get_context("spawn")
+        self._save_jobs = context.Queue()
+        self._save_results = context.Queue()
+        self._save_process = context.Process(target=self._writer.run, args=(self._save_jobs, self._save_results), daemon=True)
+        self._save_process.start()
+        # Also invoked at interpreter exit, before multiprocessing terminates the daemon process
+        self._stop_save_process = weakref.finalize(self, _stop_writer, self._save_jobs, self._save_process)
+
+    def _collect_saves(self, wait: bool) -> None:
+        """Collect the outcome of the checkpoints written by the background process.
+
+        Attributes:
+            wait (bool): If True, block until every pending checkpoint has been written
+        """
+        while self._pending_saves > 0:
+            try:
+                filename, error = self._save_results.get(timeout=1.0) if wait else self._save_results.get_nowait()
+            except queue.Empty:
+                if not wait:
+                    return
+                if not self._save_process.is_alive() and self._save_results.empty():
+                    raise RuntimeError("The checkpoint writer process exited before writing every checkpoint")
+                continue
+
+            self._pending_saves -= 1
+            if error is not None:
+                self._latest_epoch = None
+                raise RuntimeError("Failed to save the checkpoint '{}': {}".format(filename, error))
+
+    def _stage_state(self, state: Any) -> Tuple[Any, torch.Tensor]:
+        """Copy every tensor contained in a (nested) state into the staging buffer.
+
+        The copies from CUDA tensors run on a dedicated stream for each device, into a page-locked buffer, so that they
+        don't wait for the kernels queued on the default stream after the copy. Since the buffer is reused, this waits
+        for the writer process to be done with the previous checkpoint.
+
+        Attributes:
+            state (Any): The state to be staged, made of nested dicts, lists and tuples
+
+        Returns:
+            A copy of the state where every tensor is replaced by a _StagedTensor, and the buffer holding their data
+        """
+        skeleton, staged_tensors, size = _plan_staging(state)
+        self._collect_saves(wait=True)
+
+        pin = any(tensor.is_cuda for _, tensor in staged_tensors)
+        if self._staging_buffer.numel() < size or (pin and not self._staging_buffer_pinned):
+            self._staging_buffer = _allocate_staging_buffer(size, pin)
+            self._staging_buffer_pinned = pin
+
+        used_streams = set()
+        for staged_tensor, tensor in staged_tensors:
+            if tensor.is_cuda:
+                stream = self._staging_streams.get(tensor.device)
+                if stream is None:
+                    stream = self._staging_streams[tensor.device] = torch.cuda.Stream(tensor.device)
+                if stream not in used_streams:
+                    # The values to be saved are the ones computed by the kernels queued so far
+                    stream.wait_stream(torch.cuda.current_stream(tensor.device))
+                    used_streams.add(stream)
+
+                with torch.cuda.stream(stream):
+                    staged_tensor.view(self._staging_buffer).copy_(tensor.detach(), non_blocking=True)
+            else:
+                staged_tensor.view(self._staging_buffer).copy_(tensor.detach())
+
+        for stream in used_streams:
+            stream.synchronize()
+        return skeleton, self._staging_buffer
+
+    def _restore_storage(self, storage: torch.UntypedStorage, location: str) -> torch.UntypedStorage:
+        """Move a storage read by torch.load from a checkpoint in the legacy format on the CheckpointHandler's device.
+
+        The legacy format makes torch.load allocate an empty storage on the CPU and fill it only after it has been
+        restored, so moving it on a CUDA device would just copy uninitialized memory: an empty storage is directly
+        allocated on the device instead.
+
+        Attributes:
+            storage (torch.UntypedStorage): The storage read by torch.load
+            location (str): The device where the storage was located when the checkpoint was saved
+
+        Returns:
+            The storage on the CheckpointHandler's device
+        """
+        if getattr(storage, "_torch_load_uninitialized", False):
+            return torch.UntypedStorage(storage.nbytes(), device=self.device)
+        return storage.to(device=self.device)
+
+    def _load_checkpoint_file(self, path: str) -> Dict[str, Any]:
+        """Load a file written through torch.save, memory-mapping it unless it is in the legacy format.
+
+        Attributes:
+            path (str): Path of the file
+
+        Returns:
+            The content of the file
+        """
+        if zipfile.is_zipfile(path):
+            return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+        map_location = self._restore_storage if self.device.type == "cuda" else self.device
+        return torch.load(path, map_location=map_location, weights_only=True)
+
+    def _load_tensors(self, path: str, names: Optional[List[str]] = None) -> Dict[str, torch.Tensor]:
+        """Load tensors of a model's state_dict from a safetensors file, or from the state_dict of a checkpoint.
+
+        Attributes:
+            path (str): Path of the file containing the tensors
+            names (Optional[List[str]]): If present, the names of the tensors to be loaded, otherwise all of them are
+
+        Returns:
+            A dict mapping the name of each tensor to the tensor
+        """
+        if path.endswith(".safetensors"):
+            with safe_open(path, framework="pt", device=str(self.device)) as tensors:
+                return {name: tensors.get_tensor(name) for name in (tensors.keys() if names is None else names)}
+
+        state_dict = self._load_checkpoint_file(path)['state_dict']
+        return state_dict if names is None else {name: state_dict[name] for name in names}
 
     def load_checkpoint(
             self, model: torch.nn.Module, optimizer: Optional[torch.optim.Optimizer] = None, resume_path: str = "checkpoint.pth") -> CheckpointData:
         """
         Return the data from a checkpoint which path is specified by the user.
 
+        If the model's weights were saved as safetensors, they are read from the safetensors file next to the checkpoint.
+        Otherwise the checkpoint is memory-mapped, so only the pages of the file which are actually used get read: this
+        requires the checkpoint to be in the zipfile format, which is the default of torch.save, while checkpoints in the
+        legacy format are read entirely on the CheckpointHandler's device. The model may also be
+        built on the meta device, in which case it takes the loaded tensors without allocating its weights twice, and
+        is then moved to the CheckpointHandler's device.
+
         Attributes:
             resume_path (str): Path where the checkpoint is stored
             model (torch.nn.Module): The PyTorch model where the checkpoint's state_dict will be loaded
@@ -59,8 +660,48 @@ class CheckpointHandler:
         Returns:
             An instance of CheckpointData, which contains data from a loaded checkpoint
         """
-        checkpoint = torch.load(resume_path, map_location=self.device)
-        model.load_state_dict(checkpoint['state_dict'])
+        self._collect_saves(wait=True)
+        checkpoint = self._load_checkpoint_file(resume_path)
+        state_dict = checkpoint['state_dict']
+        resume_dir = os.path.dirname(resume_path)
+        if 'weights' in checkpoint:
+            state_dict.update(self._load_tensors(os.path.join(resume_dir, checkpoint['weights'])))
+
+        # The weights which didn't change since the previous save are found in the files of earlier checkpoints
+        referenced_names = {}
+        for name, tensors_file in checkpoint.get('references', {}).items():
+            referenced_names.setdefault(tensors_file, []).append(name)
+        for tensors_file, names in referenced_names.items():
+            state_dict.update(self._load_tensors(os.path.join(resume_dir, tensors_file), names))
+
+        # Tied weights are only saved once
+        for name, aliased_name in checkpoint.get('aliases', {}).items():
+            state_dict[name] = state_dict[aliased_name]
+
+        # A model built on the meta device has no storage to copy the weights into, so it takes the tensors instead
+        meta_parameter_names = {id(parameter): name for name, parameter in model.named_parameters() if parameter.is_meta}
+        assign = len(meta_parameter_names) > 0 or any(buffer.is_meta for buffer in model.buffers())
+        tied_parameter_names = [
+            (name, meta_parameter_names[id(parameter)])
+            for name, parameter in model.named_parameters(remove_duplicate=False)
+            if id(parameter) in meta_parameter_names and meta_parameter_names[id(parameter)] != name
+        ]
+        model.load_state_dict(state_dict, assign=assign)
+        if assign:
+            # load_state_dict wraps every entry in its own Parameter, which unties the tied weights
+            for name, tied_name in tied_parameter_names:
+                prefix, _, key = name.rpartition(".")
+                setattr(model.get_submodule(prefix), key, model.get_parameter(tied_name))
+            model.to(self.device)
+
+            if optimizer is not None:
+                # The optimizer still references the meta parameters which have been replaced
+                parameters = dict(model.named_parameters())
+                for param_group in optimizer.param_groups:
+                    param_group['params'] = [
+                        parameters[meta_parameter_names[id(parameter)]] if id(parameter) in meta_parameter_names else parameter
+                        for parameter in param_group['params']
+                    ]
 
         if optimizer is not None:
             optimizer.load_state_dict(checkpoint['optimizer'])
@@ -72,6 +713,8 @@ class CheckpointHandler:
         """
         Return the data from the checkpoint relative to the latest epoch.
 
+        The checkpoint_dir is scanned only the first time, after which the latest epoch is kept updated by the saves.
+
         Attributes:
             model (torch.nn.Module): The PyTorch model where the checkpoint's state_dict will be loaded
             optimizer (Optional[torch.optim.Optimizer]): If present, the PyTorch optimizer where the checkpoint's state_dict will be loaded
@@ -79,14 +722,22 @@ class CheckpointHandler:
         Returns:
             An instance of CheckpointData, which contains data from a loaded checkpoint
         """
-        chosen_checkpoint_index = sorted(map(lambda file_name: int(file_name.split(
-            ".")[0].split("-")[1]), os.listdir(self.checkpoint_dir)), reverse=True)[0]
-        return self.load_checkpoint(model, optimizer, os.path.join(self.checkpoint_dir, 'checkpoint-{}.pth'.format(chosen_checkpoint_index)))
+        self._collect_saves(wait=True)
+        if self._latest_epoch is None:
+            self._latest_epoch = max(
+                (int(entry.name.split(".")[0].split("-")[1]) for entry in os.scandir(self.checkpoint_dir or ".")
+                 if entry.name.startswith("checkpoint-") and entry.name.endswith(".pth")), default=None)
+            if self._latest_epoch is None:
+                raise FileNotFoundError("No checkpoint found in '{}'".format(self.checkpoint_dir))
+
+        return self.load_checkpoint(model, optimizer, os.path.join(self.checkpoint_dir, 'checkpoint-{}.pth'.format(self._latest_epoch)))
 
     def save_checkpoint(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, epoch: int) -> None:
         """Save a checkpoint.
         
-        Save a checkpoint, given the current model, optimizer, and epoch, to the CheckpointHandler's dir.
+        Save a checkpoint, given the current model, optimizer, and epoch, to the CheckpointHandler's dir. With
+        async_save, the weights are copied in memory before returning, while the checkpoint is written on disk by the
+        background process. If the previous checkpoint is still being written, this waits for it first.
 
         Attributes:
             model (torch.nn.Module): The PyTorch model which weigths will be saved into the checkpoint
@@ -94,15 +745,33 @@ class CheckpointHandler:
             epoch (int): The epoch associated to the checkpoint to be saved
         """
         arch = type(model).__name__
+        state_dict, aliases = _split_aliases(model.state_dict())
+        optimizer_state_dict = optimizer.state_dict()
+        if self.optimizer_dtype is not None:
+            optimizer_state_dict = _cast_optimizer_moments(optimizer_state_dict, self.optimizer_dtype)
         state = {
             'arch': arch,
             'epoch': epoch,
-            'state_dict': model.state_dict(),
-            'optimizer': optimizer.state_dict(),
+            'state_dict': state_dict,
+            'optimizer': optimizer_state_dict,
         }
+        if aliases:
+            state['aliases'] = aliases
         filename = os.path.join(self.checkpoint_dir,
                                 'checkpoint-{}.pth'.format(epoch))
-        torch.save(state, filename)
+        weights_filename = os.path.join(self.checkpoint_dir,
+                                        'checkpoint-{}.safetensors'.format(epoch)) if self.use_safetensors else None
+
+        skeleton, buffer = self._stage_state(state)
+        if not self.async_save:
+            self._writer.save(buffer, skeleton, filename, weights_filename)
+        else:
+            if self._save_process is None:
+                self._start_save_process()
+            self._save_jobs.put((buffer, skeleton, filename, weights_filename))
+            self._pending_saves += 1
+        if self._latest_epoch is not None:
+            self._latest_epoch = max(self._latest_epoch, epoch)
 
     def save_checkpoint_interval(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, epoch: int) -> None:
         """Save a checkpoint every each interval.
@@ -114,5 +783,19 @@ class CheckpointHandler:
             optimizer (torch.optim.Optimizer): The PyTorch optimizer which weigths will be saved into the checkpoint
             epoch (int): The epoch associated to the checkpoint to be saved
         """
-        if epoch % self.interval == 0:
+        if self.should_save(epoch):
             self.save_checkpoint(model, optimizer, epoch)
+
+    def should_save(self, epoch: int) -> bool:
+        """Return whether a checkpoint should be saved at the given epoch, according to the CheckpointHandler's interval.
+
+        Training loops with very short epochs can check this before calling save_checkpoint, instead of calling
+        save_checkpoint_interval at every epoch.
+
+        Attributes:
+            epoch (int): The current epoch
+
+        Returns:
+            True if the epoch is a multiple of the interval
+        """
+        return epoch % self.interval == 0
@@ -1,10 +1,12 @@
 """Contains the utils needed to record new data for consultation in TensorBoard."""
 
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, TypedDict
-from torch.utils.tensorboard import SummaryWriter
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, TypedDict
 
-@dataclass
+if TYPE_CHECKING:
+    from torch.utils.tensorboard import SummaryWriter
+
+@dataclass(slots=True)
 class TBItemData:
     """
     Class which describes an item which can be recorded inside of tensorboard.
@@ -36,6 +38,9 @@ class TensorboardWriter:
         Attributes:
             log_dir (Optional[str]): if specified, it denotes the directory where the TensorBoard logs are stored
         """
+        # Imported here since it pulls in tensorboard and protobuf, which take a while to import
+        from torch.utils.tensorboard import SummaryWriter
+
         self.writer = SummaryWriter(log_dir)
         self.tensorboard_writer_fns = [
             'add_scalar', 'add_scalars', 'add_image', 'add_figure', 'add_audio',
@@ -44,10 +49,18 @@ class TensorboardWriter:
         self.types = [
             'scalar', 'scalars', 'image', 'figure', 'audio', 'video', 'text', 'histogram', 'graph' 
         ]
+        self._fn_names = frozenset(self.tensorboard_writer_fns)
         self.tag_counter = {}
         self.tag_steps = {}
+        # Maps each supported type to the SummaryWriter function which records it
+        self._dispatch = {
+            item_type: getattr(self.writer, writer_fn_name)
+            for item_type, writer_fn_name in zip(self.types, self.tensorboard_writer_fns)
+        }
+        # Maps each recorded tag to its type and to the function recording its items, see _build_recorder
+        self._tag_dispatch = {}
 
-    def get_writer(self) -> SummaryWriter:
+    def get_writer(self) -> "SummaryWriter":
         """Get the writer used by the class instance to record values in TensorBoard.
 
         Returns:
@@ -71,54 +84,79 @@ class TensorboardWriter:
             data_dict (Dict[str, TBItemData]): Dictionary with the items which will be recorded
         """
         for tag, item_data in data_dict.items():
-            writer_fn_name = self.tensorboard_writer_fns[self.types.index(item_data.type)]
-            add_data = getattr(self.writer, writer_fn_name, None)
-
-            if item_data.type != "scalars":
-                if item_data.step is not None:
-                    step = item_data.step
-                    self.tag_steps.update({ tag: step + 1 })
-                else:
-                    if tag not in self.tag_steps:
-                        self.tag_steps[tag] = 0
-                    step = self.tag_steps[tag]
-                    self.tag_steps[tag] += 1
-            else:
-                if tag not in self.tag_steps:
-                    self.tag_steps[tag] = {}
-
-                if item_data.step is not None:
-                    step = item_data.step
-                    for scalar_tag in item_data.data.keys():
-                        self.tag_steps[tag].update({ scalar_tag: step + 1 })
-                else:
-                    related_step_keys = list(filter(lambda scalar_tag: scalar_tag in self.tag_steps[tag], item_data.data.keys()))
-                    if len(related_step_keys) == len(item_data.data.keys()):
-                        related_step_values = list(map(lambda scalar_tag: self.tag_steps[tag][scalar_tag], related_step_keys))
-                        if related_step_values.count(related_step_values[0]) == len(related_step_values):
-                            step = related_step_values[0]
-                        else:
-                            raise Exception("Step mismatch for the scalars!")
-                    elif len(related_step_keys) == 0:
-                        step = 0
-                    else:
-                        raise Exception("Step mismatch for the scalars!")
-
-                    for scalar_tag in item_data.data.keys():
-                        self.tag_steps[tag].update({ scalar_tag: step + 1 })
-            
-
-            add_data(tag, item_data.data, step)
-
-            counter = self.tag_counter.get(tag, 0)
-            self.tag_counter.update({ tag: counter + 1 })
+            dispatch = self._tag_dispatch.get(tag)
+            if dispatch is None or dispatch[0] != item_data.type:
+                dispatch = self._tag_dispatch[tag] = (item_data.type, self._build_recorder(tag, item_data.type))
+
+            dispatch[1](item_data)
+            self.tag_counter[tag] = self.tag_counter.get(tag, 0) + 1
+
+    def _build_recorder(self, tag: str, item_type: str) -> Callable[[TBItemData], None]:
+        """Build the function which records the items of a tag, keeping track of its internal step value.
+
+        Attributes:
+            tag (str): The tag whose items are recorded by the function
+            item_type (str): The type of the items recorded by the function
+
+        Returns:
+            A function which records the item it is given
+        """
+        add_data = self._dispatch.get(item_type)
+        if add_data is None:
+            raise ValueError("Unsupported type '{}'".format(item_type))
+
+        if item_type != "scalars":
+            def record(item_data: TBItemData) -> None:
+                step = item_data.step if item_data.step is not None else self.tag_steps.get(tag, 0)
+                self.tag_steps[tag] = step + 1
+                add_data(tag, item_data.data, step)
+        else:
+            def record(item_data: TBItemData) -> None:
+                scalar_steps = self.tag_steps.setdefault(tag, {})
+                step = item_data.step if item_data.step is not None else self._get_scalars_step(scalar_steps, item_data.data)
+                for scalar_tag in item_data.data:
+                    scalar_steps[scalar_tag] = step + 1
+                add_data(tag, item_data.data, step)
+
+        return record
+
+    def _get_scalars_step(self, scalar_steps: Dict[str, int], data: Dict[str, Any]) -> int:
+        """Return the internal step value of a group of scalars.
+
+        Either all the scalars were already recorded with the same step, or none of them was, in which case the step is 0.
+
+        Attributes:
+            scalar_steps (Dict[str, int]): The internal step value of each scalar recorded so far for the tag
+            data (Dict[str, Any]): The scalars to be recorded
+
+        Returns:
+            The step at which the scalars have to be recorded
+        """
+        seen_step = None
+        missing_steps = 0
+        for scalar_tag in data:
+            scalar_step = scalar_steps.get(scalar_tag)
+            if scalar_step is None:
+                missing_steps += 1
+            elif seen_step is None:
+                seen_step = scalar_step
+            elif scalar_step != seen_step:
+                raise Exception("Step mismatch for the scalars!")
+
+        if missing_steps == len(data):
+            return 0
+        if missing_steps == 0:
+            return seen_step
+        raise Exception("Step mismatch for the scalars!")
 
     def __getattr__(self, name):
         """Depending on the function name, return a function of the SummaryWriter which can be invoked to record the data."""
-        if name in self.tensorboard_writer_fns:
+        if name in self._fn_names:
             add_data = getattr(self.writer, name, None)
 
             if add_data is not None:
+                # Cached on the instance, so that the next lookups don't go through __getattr__
+                self.__dict__[name] = add_data
                 # add_data(tag, data, global_step, *args, **kwargs)
                 return add_data
         
@@ -7,5 +7,6 @@ setup(
     description='Collection of utils for PyTorch training and models',
     author='AIDAPT',
     license='MIT',
-    requires=["torch"]
+    python_requires='>=3.10',
+    install_requires=["torch", "safetensors", "numpy"]
 )
\ No newline at end of file